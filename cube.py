@@ -5,6 +5,9 @@ from random import choice
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.axes import Axes
+from matplotlib.colors import to_rgba_array
+from matplotlib.image import AxesImage
+from matplotlib.transforms import Transform
 from matplotlib.widgets import Button
 
 import pycuber as pc
@@ -21,6 +24,39 @@ from projection import project_points
     2. сделать вывод конфигурации кубика в .txt файл"""
 
 
+def format_moves(moves):
+    # (face, turns, layer) moves in the notation of pycuber, e.g. "R U' F2"
+    formula = ""
+    for i in moves:
+        formula += i[0]
+        if i[1] == -1:
+            formula += "'"
+        elif i[1] == 2:
+            formula += "2"
+        formula += " "
+    return formula
+
+
+def parse_moves(formula):
+    # pycuber notation to (face, turns, layer) moves
+    turns = {"": 1, "'": -1, "2": 2}
+    move_list = []
+    for i in formula.split():
+        if i[0] not in "UDLRFB" or i[1:] not in turns:
+            raise ValueError("unknown move %r" % i)
+        move_list.append((i[0], turns[i[1:]], 0))
+    return move_list
+
+
+def solve_moves(moves):
+    # CFOP solution (pycuber) of a 3x3x3 cube scrambled by moves
+    c = pc.Cube()
+    my_formula = pc.Formula(format_moves(moves))
+    c(my_formula)
+    solution = CFOPSolver(c).solve(suppress_progress_messages=True).__str__()
+    return parse_moves(solution)
+
+
 class Cube:
     main_color = 'black'
     face_colors = ["#ffde24", "w",
@@ -68,43 +104,20 @@ class Cube:
         self.face_colors = self.face_colors
 
         self._move_list = []
+        self._version = 0  # incremented on every change of the geometry
+        self._state = None  # integer state (facelets.py) of the geometry
+        self._state_version = None
         self._initialize_arrays()
 
     def _random(self, a):
         # a random moves for cube C
         moves = ['U', 'D', 'R', 'L', 'F', 'B']
         direction = [1, -1]
-        for i in range(1, a + 1):
-            self.rotate_face(choice(moves), choice(direction))
+        self.apply_moves([(choice(moves), choice(direction), 0) for i in range(1, a + 1)])
 
     def cube_solver(self):
         # use CFOP algorithm from pycuber
-        formula = ""
-        moves = self._move_list
-        for i in moves:
-            formula += i[0]
-            if i[1] == -1:
-                formula += "'"
-            elif i[1] == 2:
-                formula += "2"
-            formula += " "
-        c = pc.Cube()
-        my_formula = pc.Formula(formula)
-        c(my_formula)
-        solution = CFOPSolver(c).solve(suppress_progress_messages=True).__str__()
-        move_list = []
-        for i in solution.split(" "):
-            if len(i) == 2:
-                if i[1] == "'":
-                    move_list.append((i[0], -1, 0))
-                elif i[1] == "2":
-                    move_list.append((i[0], 2, 0))
-            else:
-                try:
-                    move_list.append((i[0], 1, 0))
-                except:
-                    break
-        return move_list
+        return solve_moves(self._move_list)
 
     def _initialize_arrays(self):
         # initialize centroids for stickers and faces, faces, and stickers
@@ -166,7 +179,7 @@ class Cube:
         self._colors = self._colors[ind]
         self._faces = self._faces[ind]
 
-    def rotate_face(self, f, n=1, layer=0):
+    def _record_move(self, f, n, layer):
         try:
             f_last, n_last, layer_last = self._move_list[-1]
         except:
@@ -183,14 +196,22 @@ class Cube:
         else:
             self._move_list.append((f, n, layer))
 
+    @staticmethod
+    def _layer_index(proj, n):
+        # layer of the stickers with face centroids at distance proj along the normal of
+        # a face: side stickers of layer k lie at 1 - (2k + 1) / n, the face itself at 1
+        # and the opposite face (part of the last layer) at -1
+        return np.clip(np.floor((1 - proj) * n / 2), 0, n - 1)
+
+    def rotate_face(self, f, n=1, layer=0):
+        self._record_move(f, n, layer)
+
         v = self.faces_dict[f]
         r = Quaternion.from_v_theta(v, n * np.pi / 2)
         M = r.rotation_matrix()
 
         proj = np.dot(self._face_centroids[:, :3], v)
-        cubie_width = 2. / self.n
-        flag = ((proj > 0.9 - (layer + 1) * cubie_width) &
-                (proj < 1.1 - layer * cubie_width))
+        flag = self._layer_index(proj, self.n) == layer
 
         for x in [self._stickers, self._sticker_centroids,
                   self._faces]:
@@ -198,6 +219,61 @@ class Cube:
         self._face_centroids[flag, :3] = np.dot(self._face_centroids[flag, :3],
                                                 M.T)
 
+        # whole turns keep the integer state, animation steps leave the geometry
+        # between slots and the state is read again once the turn is complete
+        if self._state_version == self._version and float(n).is_integer():
+            from facelets import move_permutation
+            self._state = self._state[move_permutation(self.n, f, int(n), layer)]
+            self._state.setflags(write=False)
+            self._state_version += 1
+        self._version += 1
+
+    def apply_moves(self, moves):
+        # apply a whole sequence of quarter/half turns at once:
+        # the sequence is compiled to one sticker permutation and every sticker
+        # takes the geometry of its new slot on a solved cube
+        from facelets import compile_moves, normalize_moves, inverse, slot_index, solved_cube
+
+        # turns are recorded as 1, -1 or 2 (the notation of format_moves)
+        moves = normalize_moves(moves, self.n)
+        perm = compile_moves(moves, self.n)
+        slots = slot_index(self._face_centroids[:, :3], self.n)
+        slots = inverse(perm)[slots]
+
+        solved = solved_cube(self.n)
+        self._faces = solved._faces[slots]
+        self._stickers = solved._stickers[slots]
+        self._sticker_centroids = solved._sticker_centroids[slots]
+        self._face_centroids[:, :3] = solved._face_centroids[slots, :3]
+
+        for (f, n, layer) in moves:
+            self._record_move(f, n, layer)
+        if self._state_version == self._version:
+            self._state = self._state[perm]
+            self._state.setflags(write=False)
+            self._state_version += 1
+        self._version += 1
+
+    def state(self):
+        # integer state: color of the sticker at every slot (read-only, shared
+        # with the cache), read from the geometry only after partial turns
+        from facelets import cube_state
+
+        if self._state_version != self._version:
+            self._state = cube_state(self)
+            self._state.setflags(write=False)
+            self._state_version = self._version
+        return self._state
+
+    def facelets(self):
+        # colors of the cube as a 6 x n x n array of faces
+        from facelets import facelet_grid
+        return facelet_grid(self.state(), self.n)
+
+    def is_solved(self):
+        from facelets import is_solved
+        return bool(is_solved(self.state()))
+
     def draw_interactive(self):
         # main func
         fig = plt.figure(figsize=(6, 6))
@@ -205,6 +281,33 @@ class Cube:
         return fig
 
 
+class Homography(Transform):
+    # projective map of the unit square onto a quadrilateral [p00, p10, p11, p01]
+    input_dims = output_dims = 2
+
+    def __init__(self, corners):
+        super(Homography, self).__init__()
+        src = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=float)
+        A = []
+        b = []
+        for (x, y), (X, Y) in zip(src, corners):
+            A.append([x, y, 1, 0, 0, 0, -x * X, -y * X])
+            A.append([0, 0, 0, x, y, 1, -x * Y, -y * Y])
+            b += [X, Y]
+        self.H = np.append(np.linalg.solve(A, b), 1).reshape(3, 3)
+
+    def transform_non_affine(self, values):
+        values = np.asarray(values, dtype=float)
+        pts = np.dot(np.hstack([values, np.ones((len(values), 1))]), self.H.T)
+        return pts[:, :2] / pts[:, 2:]
+
+    def inverted(self):
+        inv = Homography.__new__(Homography)
+        Transform.__init__(inv)
+        inv.H = np.linalg.inv(self.H)
+        return inv
+
+
 class Interactive_Cube(Axes):
     #
     def __init__(self, cube=None, view=(0, 0, 10), fig=None, rect=[0, 0.16, 1, 0.84], **kwargs):
@@ -261,6 +364,21 @@ class Interactive_Cube(Axes):
         self._face_polys = None
         self._sticker_polys = None
 
+        # depth ordering is reused while the view turns less than this angle
+        self._resort_angle = 0.05
+        self._sorted_rot = None  # rotation state of the last full depth sort
+        self._sorted_version = None  # cube geometry of the last full depth sort
+        self._visible_stickers = None  # stickers facing the viewer in the last frame
+
+        # level of detail: every cube face drawn as one image for large cubes
+        self._lod_size = 30  # smallest n drawn with images
+        self._lod_zoom = 2.  # per-sticker polygons above this zoom factor
+        self._lod_texture = 512  # size in pixels of the face images
+        self._face_images = None
+        self._face_textures = None
+        self._texture_version = None  # cube geometry of the face images
+        self._lod_active = False
+
         self._draw_cube()
 
         # connect GUI events
@@ -294,43 +412,173 @@ class Interactive_Cube(Axes):
     def _project(self, pts):
         return project_points(pts, self._current_rot, self._view, [0, 1, 0])
 
+    def _turning(self):
+        # stickers of a layer in the middle of a turn (off the grid of face centroids)
+        grid = self.cube._face_centroids[:, :3] * self.cube.n
+        return np.any(np.abs(grid - np.rint(grid)) > 1e-6, axis=1)
+
+    def _facing(self):
+        # back-face culling: outward normal of every sticker against the direction to the viewer
+        centroids = self.cube._face_centroids[:, :3]
+        normals = self.cube._sticker_centroids - centroids
+
+        R = self._current_rot.rotation_matrix()
+        normals = np.dot(normals, R.T)
+        centroids = np.dot(centroids, R.T)
+        # turning stickers are never culled, their back faces stand in for the plastic of the layer
+        return self._turning() | (np.sum(normals * (np.asarray(self._view) - centroids), axis=1) > 0)
+
+    def _needs_sort(self):
+        # full depth sort after a change of the cube or a large view rotation
+        if self._sorted_rot is None or self._sorted_version != self.cube._version:
+            return True
+        cos = abs(np.dot(self._sorted_rot.x, self._current_rot.x))
+        return 2 * np.arccos(min(cos, 1.)) > self._resort_angle
+
+    def _level_of_detail(self):
+        # draw faces as images for large cubes unless zoomed in
+        if self.cube.n < self._lod_size:
+            return False
+        xlim = self.get_xlim()
+        zoom = (self._start_xlim[1] - self._start_xlim[0]) / (xlim[1] - xlim[0])
+        return zoom <= self._lod_zoom
+
     def _draw_cube(self):
-        stickers = self._project(self.cube._stickers)[:, :, :2]
-        faces = self._project(self.cube._faces)[:, :, :2]
-        face_centroids = self._project(self.cube._face_centroids[:, :3])
-        sticker_centroids = self._project(self.cube._sticker_centroids[:, :3])
+        self._lod_active = self._level_of_detail()
+        if self._lod_active:
+            # turning stickers can't be drawn into the face images
+            turning = self._turning()
+            self._draw_face_images(~turning)
+            self._draw_stickers(turning)
+        else:
+            self._draw_face_images(None)
+            self._draw_stickers(self._facing())
+        self.figure.canvas.draw()
 
-        colors = np.asarray(self.cube.face_colors)[self.cube._colors]
+    def _draw_face_images(self, static):
+        # one image per visible cube face with the colors of its static stickers
+        if self._face_images is None:
+            if static is None:
+                return
+            self._face_images = {}
+            for f in self.cube.faces_dict:
+                im = AxesImage(self, interpolation='nearest', origin='lower',
+                               extent=(0, 1, 0, 1), visible=False)
+                self._face_images[f] = im
+                self.add_image(im)
+
+        if static is None:
+            for im in self._face_images.values():
+                im.set_visible(False)
+            return
+
+        if self._texture_version != self.cube._version:
+            self._face_textures = self._textures(static)
+            self._texture_version = self.cube._version
+            for f, im in self._face_images.items():
+                im.set_data(self._face_textures[f])
+
+        R = self._current_rot.rotation_matrix()
+        for f, v in self.cube.faces_dict.items():
+            im = self._face_images[f]
+            # in-plane axes of the face
+            u = np.roll(v, 1)
+            w = np.cross(v, u)
+            rv = np.dot(R, v)
+            if np.dot(rv, np.asarray(self._view) - rv) <= 0:
+                im.set_visible(False)
+                continue
+
+            # map the unit square onto the projected face
+            corners = self._project(np.array([v - u - w, v + u - w, v + u + w, v - u + w]))
+            im.set_transform(Homography(corners[:, :2]) + self.transData)
+            im.set_zorder(-corners[:, 2].mean())
+            im.set_visible(True)
+
+    def _textures(self, static):
+        # RGBA image of every cube face, transparent where a sticker is not static
+        n = self.cube.n
+        k = max(1, self._lod_texture // n)
+        gap = max(1, int(round(2 * k * self.cube.sticker_edge)))
+        centroids = self.cube._face_centroids[:, :3]
+        rgba = to_rgba_array(self.cube.face_colors)[self.cube._colors].astype(np.float32)
+        plastic = to_rgba_array(self.cube.main_color)[0]
+
+        # plastic between the stickers, left out when a sticker is only a few pixels
+        # wide (the gap would cover it)
+        edge = (np.arange(n * k) + gap // 2) % k < gap
+        edge = (edge[:, None] | edge[None, :]) & (k >= 4)
+
+        textures = {}
+        for f, v in self.cube.faces_dict.items():
+            u = np.roll(v, 1)
+            w = np.cross(v, u)
+            on_face = static & (np.dot(centroids, v) > 0.999)
+            i = np.floor((np.dot(centroids[on_face], u) + 1) * n / 2).astype(int)
+            j = np.floor((np.dot(centroids[on_face], w) + 1) * n / 2).astype(int)
+            small = np.zeros((n, n, 4), dtype=np.float32)
+            small[j, i] = rgba[on_face]
+
+            image = np.repeat(np.repeat(small, k, axis=0), k, axis=1)
+            image[edge & (image[:, :, 3] > 0)] = plastic
+            textures[f] = image
+        return textures
+
+    def _draw_stickers(self, visible):
+        ind = np.nonzero(visible)[0]
+
+        # project only the visible geometry
+        stickers = self._project(self.cube._stickers[ind])[:, :, :2]
+        faces = self._project(self.cube._faces[ind])[:, :, :2]
+
+        if self._needs_sort() or self._face_polys is None:
+            resort = np.ones(len(ind), dtype=bool)
+            self._sorted_rot = self._current_rot
+            self._sorted_version = self.cube._version
+        else:
+            # keep the previous ordering, sort only stickers that came into view
+            resort = ~self._visible_stickers[ind]
+
+        face_centroids = self._project(self.cube._face_centroids[ind[resort], :3])
+        sticker_centroids = self._project(self.cube._sticker_centroids[ind[resort], :3])
         face_zorders = -face_centroids[:, 2]
         sticker_zorders = -sticker_centroids[:, 2]
 
+        colors = np.asarray(self.cube.face_colors)[self.cube._colors]
+
         if self._face_polys is None:
-            # create polygon objects and add to axes
-            self._face_polys = []
-            self._sticker_polys = []
-
-            for i in range(len(colors)):
-                fp = plt.Polygon(faces[i], facecolor=self.cube.main_color,
-                                 zorder=face_zorders[i])
-                sp = plt.Polygon(stickers[i], facecolor=colors[i],
-                                 zorder=sticker_zorders[i])
-
-                self._face_polys.append(fp)
-                self._sticker_polys.append(sp)
+            # polygon objects are created the first time they are drawn
+            self._face_polys = [None] * len(colors)
+            self._sticker_polys = [None] * len(colors)
+            self._visible_stickers = np.zeros(len(colors), dtype=bool)
+
+        # hide stickers turned away from the viewer
+        for i in np.nonzero(self._visible_stickers & ~visible)[0]:
+            self._face_polys[i].set_visible(False)
+            self._sticker_polys[i].set_visible(False)
+
+        # update the visible polygon objects
+        for j, i in enumerate(ind):
+            if self._face_polys[i] is None:
+                fp = plt.Polygon(faces[j], facecolor=self.cube.main_color)
+                sp = plt.Polygon(stickers[j], facecolor=colors[i])
+
+                self._face_polys[i] = fp
+                self._sticker_polys[i] = sp
                 self.add_patch(fp)
                 self.add_patch(sp)
-        else:
-            # update the polygon objects
-            for i in range(len(colors)):
-                self._face_polys[i].set_xy(faces[i])
-                self._face_polys[i].set_zorder(face_zorders[i])
-                self._face_polys[i].set_facecolor(self.cube.main_color)
+                continue
+            self._face_polys[i].set_xy(faces[j])
+            self._sticker_polys[i].set_xy(stickers[j])
+            if not self._visible_stickers[i]:
+                self._face_polys[i].set_visible(True)
+                self._sticker_polys[i].set_visible(True)
 
-                self._sticker_polys[i].set_xy(stickers[i])
-                self._sticker_polys[i].set_zorder(sticker_zorders[i])
-                self._sticker_polys[i].set_facecolor(colors[i])
+        for j, i in enumerate(ind[resort]):
+            self._face_polys[i].set_zorder(face_zorders[j])
+            self._sticker_polys[i].set_zorder(sticker_zorders[j])
 
-        self.figure.canvas.draw()
+        self._visible_stickers = visible
 
     def rotate(self, rot):
         self._current_rot = self._current_rot * rot
@@ -441,7 +689,10 @@ class Interactive_Cube(Axes):
                 self.set_xlim(factor * xlim[0], factor * xlim[1])
                 self.set_ylim(factor * ylim[0], factor * ylim[1])
 
-                self.figure.canvas.draw()
+                if self._level_of_detail() != self._lod_active:
+                    self._draw_cube()
+                else:
+                    self.figure.canvas.draw()
 
 
 if __name__ == '__main__':
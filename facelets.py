@@ -0,0 +1,239 @@
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+
+from quaternion import Quaternion
+from cube import Cube
+
+# integer representation of a cube state:
+# state[i] is the color (index into Cube.face_colors) of the sticker at slot i,
+# slots are numbered in the order of Cube._sort_faces for a solved cube
+# a move is a permutation p of the slots: new_state = state[p]
+
+
+@lru_cache(maxsize=None)
+def solved_cube(n):
+    # shared solved cube, its geometry gives the template of every slot
+    return Cube(n)
+
+
+@lru_cache(maxsize=None)
+def _geometry(n):
+    # slot positions (face centroids of a solved cube) and their sorted keys
+    cube = solved_cube(n)
+    positions = cube._face_centroids[:, :3].copy()
+    keys = _keys(positions, n)
+    order = np.argsort(keys)
+    return positions, cube._colors.copy(), keys[order], order
+
+
+def _keys(points, n):
+    # every slot lies on an integer grid after scaling by n
+    grid = np.rint(np.asarray(points) * n).astype(np.int64) + n
+    return (grid[..., 0] * (2 * n + 1) + grid[..., 1]) * (2 * n + 1) + grid[..., 2]
+
+
+def slot_positions(n):
+    return _geometry(n)[0]
+
+
+def solved_state(n):
+    return _geometry(n)[1].copy()
+
+
+def slot_index(points, n):
+    # slot numbers of points lying on the face centroids of the cube
+    _, _, sorted_keys, order = _geometry(n)
+    keys = _keys(points, n)
+    ind = np.searchsorted(sorted_keys, keys)
+    ind = np.minimum(ind, len(sorted_keys) - 1)
+    if not np.all(sorted_keys[ind] == keys):
+        raise ValueError("points do not lie on the slots of the cube")
+    return order[ind]
+
+
+def face_colors(n):
+    # face name for each color index
+    positions, colors = _geometry(n)[:2]
+    names = {}
+    for f, v in Cube.faces_dict.items():
+        c = colors[np.argmax(np.dot(positions, v))]
+        names[int(c)] = f
+    return [names[c] for c in range(6)]
+
+
+def point_permutation(n, M, flag=None):
+    # slot permutation for the linear map M applied to the slots selected by flag
+    positions = slot_positions(n)
+    dest = np.arange(len(positions))
+    if flag is None:
+        flag = np.ones(len(positions), dtype=bool)
+    dest[flag] = slot_index(np.dot(positions[flag], np.asarray(M).T), n)
+    if len(np.unique(dest)) != len(dest):
+        raise ValueError("the map does not permute the slots of the cube")
+    perm = np.empty_like(dest)
+    perm[dest] = np.arange(len(dest))
+    return perm
+
+
+def layer_flag(n, f, layer=0):
+    # same selection of slots as Cube.rotate_face
+    proj = np.dot(slot_positions(n), Cube.faces_dict[f])
+    return Cube._layer_index(proj, n) == layer
+
+
+@lru_cache(maxsize=None)
+def _move_permutation(n, f, turns, layer):
+    if turns == 0:
+        perm = np.arange(6 * n ** 2)
+        perm.setflags(write=False)
+        return perm
+    M = Quaternion.from_v_theta(Cube.faces_dict[f], turns * np.pi / 2).rotation_matrix()
+    perm = point_permutation(n, np.rint(M), layer_flag(n, f, layer))
+    perm.setflags(write=False)
+    return perm
+
+
+def move_permutation(n, f, turns=1, layer=0):
+    # permutation for a quarter/half turn, same convention as Cube.rotate_face
+    turns = int(turns) % 4
+    return _move_permutation(n, f, turns, layer)
+
+
+@lru_cache(maxsize=1024)
+def _compile(n, moves):
+    perm = np.arange(6 * n ** 2)
+    for (f, turns, layer) in moves:
+        perm = perm[_move_permutation(n, f, turns, layer)]
+    perm.setflags(write=False)
+    return perm
+
+
+def normalize_moves(moves, n):
+    # checked (face, turns, layer) moves with turns 1, -1 or 2, whole turns dropped
+    result = []
+    for (f, turns, layer) in moves:
+        if f not in Cube.faces_dict or turns != int(turns) or layer != int(layer) \
+                or not 0 <= layer < n:
+            raise ValueError("invalid move %r" % ((f, turns, layer),))
+        turns = int(turns) % 4
+        if turns:
+            result.append((f, {1: 1, 2: 2, 3: -1}[turns], int(layer)))
+    return result
+
+
+def compile_moves(moves, n):
+    # one permutation for a whole sequence of (face, turns, layer) moves,
+    # compiled sequences are cached
+    return _compile(n, tuple(normalize_moves(moves, n)))
+
+
+def invert_moves(moves):
+    return [(f, -turns, layer) for (f, turns, layer) in moves[::-1]]
+
+
+def inverse(perm):
+    return np.argsort(perm)
+
+
+def power(perm, k):
+    # perm applied k times (exponentiation by squaring)
+    perm = np.asarray(perm)
+    if k < 0:
+        perm, k = inverse(perm), -k
+    result = np.arange(len(perm))
+    while k:
+        if k & 1:
+            result = result[perm]
+        perm = perm[perm]
+        k >>= 1
+    return result
+
+
+def order(perm):
+    # number of repetitions of perm that give the identity (lcm of the cycle lengths)
+    perm = np.asarray(perm)
+    seen = np.zeros(len(perm), dtype=bool)
+    result = 1
+    for start in range(len(perm)):
+        length = 0
+        i = start
+        while not seen[i]:
+            seen[i] = True
+            i = perm[i]
+            length += 1
+        if length:
+            result = result * length // gcd(result, length)
+    return result
+
+
+def apply_moves(state, moves, n=None):
+    # apply a list of (face, turns, layer) moves to a state or a batch of states
+    state = np.asarray(state)
+    if n is None:
+        n = int(round(np.sqrt(state.shape[-1] / 6)))
+    return state[..., compile_moves(moves, n)]
+
+
+@lru_cache(maxsize=None)
+def _grid_order(n):
+    # slot at [face, row, column] of facelet_grid
+    positions = slot_positions(n)
+    colors = _geometry(n)[1]
+    ups = dict(U=-Cube.faces_dict['F'], D=Cube.faces_dict['F'])
+    grid = np.empty((6, n, n), dtype=int)
+    for c, f in enumerate(face_colors(n)):
+        normal = Cube.faces_dict[f]
+        up = ups.get(f, Cube.faces_dict['U'])
+        right = np.cross(up, normal)
+        slots = np.flatnonzero(colors == c)
+        rows = np.rint((1 - np.dot(positions[slots], up)) * n / 2 - 0.5).astype(int)
+        cols = np.rint((1 + np.dot(positions[slots], right)) * n / 2 - 0.5).astype(int)
+        grid[c, rows, cols] = slots
+    grid.setflags(write=False)
+    return grid
+
+
+def facelet_grid(state, n=None):
+    # colors of a state (or a batch of states) as 6 x n x n faces, in the order
+    # of the colors of the solved cube (face_colors), every face seen from outside
+    # the cube as in the usual net: side faces with U at the top (row 0),
+    # U with B at the top and D with F at the top
+    state = np.asarray(state)
+    if n is None:
+        n = int(round(np.sqrt(state.shape[-1] / 6)))
+    return state[..., _grid_order(n)]
+
+
+def is_solved(state):
+    # every face of one color (in any orientation of the whole cube),
+    # works on one state or a batch of states
+    state = np.asarray(state)
+    faces = state.reshape(state.shape[:-1] + (6, -1))
+    return np.all(faces == faces[..., :1], axis=(-2, -1))
+
+
+def apply_each(states, perms):
+    # a different permutation for every state of a batch
+    return np.take_along_axis(np.asarray(states), np.asarray(perms), axis=-1)
+
+
+def verify_solutions(states, solutions, n=None):
+    # True where the solution (list of moves) of a state solves it
+    states = np.atleast_2d(states)
+    if n is None:
+        n = int(round(np.sqrt(states.shape[-1] / 6)))
+    perms = np.array([compile_moves(moves, n) for moves in solutions])
+    return is_solved(apply_each(states, perms))
+
+
+def cube_state(cube):
+    # integer state of a Cube read from its sticker geometry
+    return state_from_geometry(cube._face_centroids[:, :3], cube._colors, cube.n)
+
+
+def state_from_geometry(face_centroids, colors, n):
+    state = np.empty(len(colors), dtype=np.asarray(colors).dtype)
+    state[slot_index(face_centroids, n)] = colors
+    return state
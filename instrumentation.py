@@ -0,0 +1,251 @@
+import sys
+import json
+import threading
+import cProfile
+import pstats
+from time import perf_counter
+from functools import wraps
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from cube import Cube, Interactive_Cube
+
+# hot path instrumentation: enable() wraps the methods of Cube and Interactive_Cube
+# with timers and counters, disable() puts the original methods back,
+# so nothing is measured (and nothing is paid) while disabled
+
+
+class Stats:
+    # per stage timers (seconds) and counters
+    def __init__(self, max_samples=100000):
+        self.max_samples = max_samples
+        self.reset()
+
+    def reset(self):
+        self.timers = defaultdict(list)
+        self.counters = Counter()
+        self._frame_starts = []
+        self._depth = 0  # > 0 inside an animated move of Interactive_Cube
+
+    def add(self, stage, seconds):
+        samples = self.timers[stage]
+        if len(samples) >= self.max_samples:
+            # keep the most recent samples
+            del samples[:len(samples) // 2]
+        samples.append(seconds)
+
+    def count(self, name, k=1):
+        self.counters[name] += k
+
+    def fps(self, frames=20):
+        starts = self._frame_starts[-frames:]
+        if len(starts) < 2:
+            return 0.
+        return (len(starts) - 1) / (starts[-1] - starts[0])
+
+    def summary(self):
+        # milliseconds per stage: count, total, mean, p50, p99, max
+        stages = {}
+        for stage, samples in self.timers.items():
+            ms = 1000 * np.asarray(samples)
+            stages[stage] = dict(count=len(ms), total=float(ms.sum()), mean=float(ms.mean()),
+                                 p50=float(np.percentile(ms, 50)),
+                                 p99=float(np.percentile(ms, 99)),
+                                 max=float(ms.max()))
+        return dict(stages=stages, counters=dict(self.counters), fps=self.fps())
+
+    def to_json(self, path=None):
+        text = json.dumps(self.summary(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+
+stats = Stats()
+_originals = {}
+_canvases = []
+_overlay = False
+_texts = []  # overlay texts shown so far
+
+
+def _wrap(cls, name, stage, before=None, after=None):
+    original = cls.__dict__[name]
+
+    @wraps(original)
+    def wrapper(self, *args, **kwargs):
+        if before is not None:
+            before(self, args, kwargs)
+        start = perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            stats.add(stage, perf_counter() - start)
+            if after is not None:
+                after(self, args, kwargs)
+
+    _originals[(cls, name)] = original
+    setattr(cls, name, wrapper)
+
+
+def _count_move(self, args, kwargs):
+    # animation steps of Interactive_Cube.rotate_face are not separate moves
+    if stats._depth == 0:
+        stats.count('moves')
+
+
+def _count_moves(self, args, kwargs):
+    moves = args[0] if args else kwargs['moves']
+    if hasattr(moves, '__len__'):
+        stats.count('moves', len(moves))
+
+
+def _start_animation(self, args, kwargs):
+    stats._depth += 1
+
+
+def _end_animation(self, args, kwargs):
+    stats._depth -= 1
+    stats.count('moves')
+
+
+def _count_polygons(self, args, kwargs):
+    stats.count('polygons', 2 * int(np.sum(args[0])))
+
+
+def _start_frame(self, args, kwargs):
+    stats.count('frames')
+    stats._frame_starts.append(perf_counter())
+    del stats._frame_starts[:-100]
+
+    # time canvas.draw() of this figure
+    canvas = self.figure.canvas
+    if canvas not in _canvases:
+        draw = canvas.draw
+
+        @wraps(draw)
+        def timed_draw(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return draw(*args, **kwargs)
+            finally:
+                stats.add('canvas_draw', perf_counter() - start)
+
+        canvas.draw = timed_draw
+        _canvases.append(canvas)
+
+    if _overlay:
+        _update_overlay(self)
+
+
+def _update_overlay(ax):
+    # frames per second and latency of the last frame in the corner of the axes
+    text = getattr(ax, '_stats_text', None)
+    if text is None:
+        text = ax.text(0.02, 0.98, '', transform=ax.transAxes, va='top',
+                       family='monospace', fontsize=8, zorder=1e6)
+        ax._stats_text = text
+        _texts.append(text)
+    frames = stats.timers.get('frame')
+    last = 1000 * frames[-1] if frames else 0.
+    text.set_text("%5.1f fps  %6.1f ms" % (stats.fps(), last))
+    text.set_visible(True)
+
+
+def _count_solve(self, args, kwargs):
+    stats.count('solver_calls')
+
+
+def enable(overlay=False):
+    # start collecting timers and counters, optionally with an on-screen overlay
+    global _overlay
+    _overlay = overlay
+    if not overlay:
+        _remove_overlay()
+    if _originals:
+        return stats
+    _wrap(Cube, 'rotate_face', 'rotate_face', after=_count_move)
+    _wrap(Cube, 'apply_moves', 'apply_moves', after=_count_moves)
+    _wrap(Cube, 'cube_solver', 'solve', after=_count_solve)
+    _wrap(Interactive_Cube, 'rotate_face', 'animated_move',
+          before=_start_animation, after=_end_animation)
+    _wrap(Interactive_Cube, '_project', 'project')
+    _wrap(Interactive_Cube, '_draw_stickers', 'update_polygons', after=_count_polygons)
+    _wrap(Interactive_Cube, '_draw_face_images', 'update_images')
+    _wrap(Interactive_Cube, '_draw_cube', 'frame', before=_start_frame)
+    return stats
+
+
+def disable():
+    # restore the original methods
+    global _overlay
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+    for canvas in _canvases:
+        del canvas.draw
+    del _canvases[:]
+    _overlay = False
+    _remove_overlay()
+
+
+def _remove_overlay():
+    for text in _texts:
+        ax = text.axes
+        text.remove()
+        del ax._stats_text
+        ax.figure.canvas.draw_idle()
+    del _texts[:]
+
+
+@contextmanager
+def profile_session(path=None, sampled=False, interval=0.005, limit=30):
+    # cProfile (or a sampling profiler of the calling thread) for the enclosed code,
+    # stats are written to path (.prof for cProfile, json for sampling) or printed
+    if not sampled:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            if path is not None:
+                profiler.dump_stats(path)
+            else:
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(limit)
+        return
+
+    samples = Counter()
+    thread_id = threading.get_ident()
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = "%s:%d(%s)" % (code.co_filename, code.co_firstlineno, code.co_name)
+                # count every function on the stack once per sample
+                if key not in seen:
+                    samples[key] += 1
+                    seen.add(key)
+                frame = frame.f_back
+            samples['<total>'] += 1
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield samples
+    finally:
+        done.set()
+        sampler.join()
+        top = dict(samples.most_common(limit))
+        if path is not None:
+            with open(path, 'w') as f:
+                json.dump(top, f, indent=2)
+        else:
+            for key, k in top.items():
+                print("%6d  %s" % (k, key))
@@ -0,0 +1,386 @@
+import os
+import json
+from multiprocessing import Pool
+
+import numpy as np
+
+from facelets import slot_positions, solved_state, move_permutation
+from symmetry import face_moves
+
+# pattern databases: exact distances (in moves) of a subset of tracked pieces
+# every entry of the table is the distance of one ranked pattern,
+# packed 2 entries per byte ('nibble') or 4 entries per byte as distance mod 3 ('mod3')
+# the entries of the level being expanded are kept in a separate bitmap (1 bit per entry),
+# since distances mod 3 do not tell the last level from the levels 3, 6, ... before it
+
+PACKINGS = {'nibble': 4, 'mod3': 2}
+UNSEEN = {'nibble': 15, 'mod3': 3}
+
+
+def cubies(n):
+    # slots grouped by cubie, each cubie ordered clockwise around its
+    # diagonal starting from the U/D (else F/B, else L/R) sticker
+    positions = slot_positions(n)
+    colors = solved_state(n)
+    normals = np.rint(positions).astype(int) * (np.abs(positions) > 0.999)
+    centers = positions - normals / n
+    keys = np.rint(centers * n).astype(int)
+
+    groups = {}
+    for i, k in enumerate(map(tuple, keys)):
+        groups.setdefault(k, []).append(i)
+
+    priority = np.array([0, 0, 2, 2, 1, 1])
+    result = []
+    for k in sorted(groups):
+        slots = np.array(groups[k])
+        c = centers[slots[0]]
+        if len(slots) > 2:
+            # angles around the cubie axis
+            e1 = np.cross(c, [0.3, 0.5, 0.7])
+            e1 /= np.linalg.norm(e1)
+            e2 = np.cross(c, e1)
+            e2 /= np.linalg.norm(e2)
+            angles = np.arctan2(np.dot(positions[slots], e2), np.dot(positions[slots], e1))
+            slots = slots[np.argsort(-angles)]
+        first = np.argmin(priority[colors[slots]])
+        result.append(np.roll(slots, -first))
+    return result
+
+
+def corner_pieces(n=3):
+    return [c[0] for c in cubies(n) if len(c) == 3]
+
+
+def edge_pieces(n=3, count=None):
+    edges = [c[0] for c in cubies(n) if len(c) == 2]
+    return edges[:count]
+
+
+class PatternDatabase:
+    def __init__(self, n, pieces, path, packing='nibble', moves=None):
+        if packing not in PACKINGS:
+            raise ValueError("unknown packing %r" % packing)
+        self.n = n
+        self.pieces = np.asarray(pieces, dtype=int)
+        self.path = path
+        self.packing = packing
+        self.moves = face_moves() if moves is None else [tuple(m) for m in moves]
+        self.bits = PACKINGS[packing]
+        self.unseen = UNSEEN[packing]
+
+        self._initialize_tables()
+        self.table = None
+
+    def _initialize_tables(self):
+        # slot -> (location, orientation) lookup for the orbit of the pieces
+        perms = [move_permutation(self.n, *m) for m in self.moves]
+        self._dest = np.array([np.argsort(p) for p in perms])
+
+        orbit = set(self.pieces.tolist())
+        frontier = list(orbit)
+        while frontier:
+            new = set(self._dest[:, frontier].ravel().tolist()) - orbit
+            orbit |= new
+            frontier = list(new)
+
+        groups = [[s for s in c if s in orbit] for c in cubies(self.n)]
+        groups = [g for g in groups if g]
+        sizes = {len(g) for g in groups}
+        if len(sizes) != 1:
+            raise ValueError("pieces do not form a regular orbit")
+
+        n_slots = 6 * self.n ** 2
+        self._location = -np.ones(n_slots, dtype=int)
+        self._orientation = -np.ones(n_slots, dtype=int)
+        self._slot = np.zeros((len(groups), sizes.pop()), dtype=int)
+        for l, g in enumerate(groups):
+            for o, s in enumerate(g):
+                self._location[s] = l
+                self._orientation[s] = o
+                self._slot[l, o] = s
+
+        self.n_locations, self.n_orientations = self._slot.shape
+        k = len(self.pieces)
+        if k > self.n_locations:
+            raise ValueError("too many pieces for the orbit")
+
+        # the last orientation is redundant when the orientation sum is invariant
+        self._constrained = (k == self.n_locations and self.n_orientations > 1
+                             and self._orientation_invariant())
+        k_free = k - 1 if self._constrained else k
+
+        self._radices = np.arange(self.n_locations, self.n_locations - k, -1)
+        self.n_permutations = int(np.prod(self._radices, dtype=object))
+        self.n_twists = self.n_orientations ** k_free
+        self.size = self.n_permutations * self.n_twists
+
+    def _orientation_invariant(self, count=256, depth=60):
+        rng = np.random.default_rng(0)
+        slots = np.tile(self.pieces, (count, 1))
+        for m in rng.integers(len(self.moves), size=(depth, count)):
+            slots = self._dest[m[:, None], slots]
+        return np.all(self._orientation[slots].sum(1) % self.n_orientations == 0)
+
+    # ranking of patterns: slots of the tracked pieces <-> table index
+
+    def rank(self, slots):
+        slots = np.atleast_2d(slots)
+        loc = self._location[slots]
+        ori = self._orientation[slots]
+        k = loc.shape[1]
+
+        perm_rank = np.zeros(len(loc), dtype=np.int64)
+        for i in range(k):
+            digit = loc[:, i] - np.sum(loc[:, :i] < loc[:, i:i + 1], axis=1)
+            perm_rank = perm_rank * self._radices[i] + digit
+
+        twist_rank = np.zeros(len(loc), dtype=np.int64)
+        for i in range(k - 1 if self._constrained else k):
+            twist_rank = twist_rank * self.n_orientations + ori[:, i]
+        return perm_rank * self.n_twists + twist_rank
+
+    def unrank(self, ranks):
+        ranks = np.asarray(ranks, dtype=np.int64)
+        perm_rank, twist_rank = np.divmod(ranks, self.n_twists)
+        k = len(self.pieces)
+
+        digits = np.zeros((len(ranks), k), dtype=np.int64)
+        for i in range(k - 1, -1, -1):
+            perm_rank, digits[:, i] = np.divmod(perm_rank, self._radices[i])
+
+        loc = np.zeros((len(ranks), k), dtype=np.int64)
+        used = np.zeros((len(ranks), self.n_locations), dtype=bool)
+        rows = np.arange(len(ranks))
+        for i in range(k):
+            free = np.cumsum(~used, axis=1)
+            loc[:, i] = np.argmax(free > digits[:, i:i + 1], axis=1)
+            used[rows, loc[:, i]] = True
+
+        ori = np.zeros((len(ranks), k), dtype=np.int64)
+        k_free = k - 1 if self._constrained else k
+        for i in range(k_free - 1, -1, -1):
+            twist_rank, ori[:, i] = np.divmod(twist_rank, self.n_orientations)
+        if self._constrained:
+            ori[:, -1] = -ori[:, :-1].sum(1) % self.n_orientations
+        return self._slot[loc, ori]
+
+    def pattern(self, perm):
+        # slots of the tracked pieces for a sticker permutation
+        # (as returned by facelets.apply_moves applied to np.arange(6 * n**2))
+        perm = np.atleast_2d(perm)
+        where = np.argsort(perm, axis=1)
+        return where[:, self.pieces]
+
+    # table storage
+
+    def _metadata(self):
+        return dict(n=self.n, pieces=self.pieces.tolist(), packing=self.packing,
+                    moves=self.moves, size=self.size)
+
+    def _open(self, mode):
+        n_bytes = -(-self.size * self.bits // 8)
+        if mode == 'w+':
+            table = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.uint8,
+                                              shape=(n_bytes,))
+            table[:] = 0xFF
+            return table
+        return np.load(self.path, mmap_mode=mode)
+
+    def _checkpoint(self, depth, complete=False):
+        self.table.flush()
+        info = self._metadata()
+        info.update(depth=depth, complete=complete)
+        tmp = self.path + '.json.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(info, f)
+        os.replace(tmp, self.path + '.json')
+
+    def _frontier_path(self, depth):
+        return '%s.frontier%d.npy' % (self.path, depth)
+
+    def _save_frontier(self, depth, bitmap):
+        # written before the checkpoint of its level, the previous one is removed after it
+        tmp = self._frontier_path(depth) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, bitmap)
+        os.replace(tmp, self._frontier_path(depth))
+
+    @classmethod
+    def load(cls, path, mode='r'):
+        # open a finished (or checkpointed) database as a read-only memory map
+        with open(path + '.json') as f:
+            info = json.load(f)
+        pdb = cls(info['n'], info['pieces'], path, info['packing'], info['moves'])
+        pdb.table = pdb._open(mode)
+        pdb.depth = info['depth']
+        pdb.complete = info['complete']
+        return pdb
+
+    # building
+
+    def build(self, processes=None, chunk_size=1 << 20, verbose=False):
+        # breadth first expansion from the solved pattern, resumable from checkpoints
+        depth = 0
+        info = None
+        if os.path.exists(self.path) and os.path.exists(self.path + '.json'):
+            with open(self.path + '.json') as f:
+                info = json.load(f)
+            saved = dict(info)
+            saved['moves'] = [tuple(m) for m in saved['moves']]
+            if {k: saved[k] for k in self._metadata()} != self._metadata():
+                raise ValueError("checkpoint %s belongs to another database" % self.path)
+
+        if info is None:
+            self.table = self._open('w+')
+            goal = self.rank(self.pieces)
+            _set(self.table, goal, np.zeros(1, dtype=np.uint8), self.bits)
+            bitmap = np.zeros(-(-self.size // 8), dtype=np.uint8)
+            _mark(bitmap, goal)
+            self._save_frontier(0, bitmap)
+            self._checkpoint(0)
+        else:
+            self.table = self._open('r+')
+            depth = info['depth']
+            if info['complete']:
+                self.depth, self.complete = depth, True
+                return self
+
+        chunks = [(start, min(start + chunk_size, self.size))
+                  for start in range(0, self.size, chunk_size)]
+        pool = Pool(processes) if processes != 1 else None
+        try:
+            while True:
+                if depth + 1 >= self.unseen and self.packing == 'nibble':
+                    raise ValueError("depth exceeds nibble range")
+                args = [(self.path, self.n, self.pieces.tolist(), self.packing, self.moves,
+                         start, stop, depth) for (start, stop) in chunks]
+                results = pool.imap_unordered(_expand, args) if pool else map(_expand, args)
+
+                # children at depth + 1, including those set before an interrupted run
+                bitmap = np.zeros(-(-self.size // 8), dtype=np.uint8)
+                value = _stored(depth + 1, self.packing)
+                for children in results:
+                    _mark(bitmap, children)
+                    found = _get(self.table, children, self.bits) == self.unseen
+                    children = children[found]
+                    _set(self.table, children,
+                         np.full(len(children), value, dtype=np.uint8), self.bits)
+                new = int(np.unpackbits(bitmap).sum(dtype=np.int64))
+
+                if verbose:
+                    print("depth %d: %d patterns" % (depth + 1, new))
+                if new == 0:
+                    self._checkpoint(depth, complete=True)
+                    os.remove(self._frontier_path(depth))
+                    break
+                depth += 1
+                self._save_frontier(depth, bitmap)
+                self._checkpoint(depth)
+                os.remove(self._frontier_path(depth - 1))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        self.depth, self.complete = depth, True
+        return self
+
+    # lookup
+
+    def neighbors(self, ranks):
+        slots = self.unrank(ranks)
+        return np.stack([self.rank(self._dest[m][slots]) for m in range(len(self.moves))], 1)
+
+    def __getitem__(self, ranks):
+        # raw stored values (distance, or distance mod 3)
+        return _get(self.table, np.atleast_1d(ranks), self.bits)
+
+    def distance(self, perm):
+        # exact pattern distance of a sticker permutation
+        rank = self.rank(self.pattern(perm))[:1]
+        value = int(self[rank][0])
+        if value == self.unseen:
+            raise ValueError("pattern is not in the database")
+        if self.packing == 'nibble':
+            return value
+
+        # mod 3 storage: walk down to the goal one level at a time
+        goal = self.rank(self.pieces)[0]
+        steps = 0
+        while rank[0] != goal:
+            children = self.neighbors(rank)[0]
+            values = self[children]
+            rank = children[values == (value - 1) % 3][:1]
+            value = (value - 1) % 3
+            steps += 1
+        return steps
+
+
+def _stored(depth, packing):
+    return depth % 3 if packing == 'mod3' else depth
+
+
+def _get(table, idx, bits):
+    per_byte = 8 // bits
+    idx = np.asarray(idx, dtype=np.int64)
+    shift = (idx % per_byte) * bits
+    return (table[idx // per_byte] >> shift.astype(np.uint8)) & ((1 << bits) - 1)
+
+
+def _mark(bitmap, idx):
+    idx = np.asarray(idx, dtype=np.int64)
+    np.bitwise_or.at(bitmap, idx >> 3, (0x80 >> (idx & 7)).astype(np.uint8))
+
+
+def _set(table, idx, values, bits):
+    # entries sharing a byte are written in separate passes
+    per_byte = 8 // bits
+    mask = (1 << bits) - 1
+    for k in range(per_byte):
+        sel = idx % per_byte == k
+        byte = idx[sel] // per_byte
+        shift = k * bits
+        table[byte] = (table[byte] & ~np.uint8(mask << shift)) | (values[sel] << shift).astype(np.uint8)
+
+
+_workers = {}
+
+
+def _expand(args):
+    # worker: expand the frontier entries of one chunk of the table
+    path, n, pieces, packing, moves, start, stop, depth = args
+    key = (path, n, tuple(pieces), packing, tuple(map(tuple, moves)))
+    if key not in _workers:
+        _workers.clear()
+        _workers[key] = PatternDatabase(n, pieces, path, packing, moves)
+    pdb = _workers[key]
+    table = np.load(path, mmap_mode='r')
+    bitmap = np.load(pdb._frontier_path(depth), mmap_mode='r')
+    bits = PACKINGS[packing]
+
+    marked = np.unpackbits(bitmap[start // 8:-(-stop // 8)])[start % 8:]
+    frontier = start + np.flatnonzero(marked[:stop - start])
+    if len(frontier) == 0:
+        return np.zeros(0, dtype=np.int64)
+    children = pdb.neighbors(frontier).ravel()
+    children = np.unique(children)
+    # neighbours of depth d are at d - 1, d or d + 1, so the stored value of d + 1
+    # can only mean d + 1 (set by an interrupted run of this level)
+    values = _get(table, children, bits)
+    return children[(values == UNSEEN[packing]) | (values == _stored(depth + 1, packing))]
+
+
+if __name__ == '__main__':
+    import sys
+
+    try:
+        path = sys.argv[1]
+    except IndexError:
+        path = 'corners.npy'
+    try:
+        packing = sys.argv[2]
+    except IndexError:
+        packing = 'nibble'
+
+    PatternDatabase(3, corner_pieces(3), path, packing).build(verbose=True)
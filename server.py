@@ -0,0 +1,333 @@
+import sys
+import json
+import asyncio
+from random import Random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cube import format_moves, parse_moves, solve_moves
+from facelets import compile_moves, normalize_moves, solved_state, face_colors, is_solved
+
+# asyncio cube server: one JSON request per line, one JSON response per line
+#
+#   {"id": 1, "op": "new", "cube": "a", "n": 3}
+#   {"id": 2, "op": "scramble", "cube": "a", "moves": 25, "seed": 7}
+#   {"id": 3, "op": "apply", "cube": "a", "moves": "R U R' U'"}
+#   {"id": 4, "op": "state", "cube": "a"}
+#   {"id": 5, "op": "solve", "cube": "a"}
+#
+# responses carry the id of their request ({"id": 1, "result": ...} or
+# {"id": 1, "error": "..."}) and may come back out of order
+
+
+class CubeServer:
+    def __init__(self, max_clients=64, max_pending=16, max_solves=4, solve_workers=None,
+                 max_line=1 << 20, max_n=128, max_moves=1000):
+        self.max_clients = max_clients
+        self.max_pending = max_pending  # requests in flight per connection
+        self.max_solves = max_solves  # solves running in the process pool
+        self.max_line = max_line
+        self.max_n = max_n  # geometry of every size is built once and kept
+        self.max_moves = max_moves  # per scramble/apply request
+
+        self.cubes = {}  # name -> dict(n, perm, history)
+        self._solve_workers = solve_workers
+        self._pool = None
+        self._solves = {}  # in-flight solves by state
+        self._solve_slots = None
+        self._writers = set()
+        self._server = None
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        # listen on a local TCP port or a Unix socket (path)
+        self._pool = ProcessPoolExecutor(self._solve_workers)
+        self._solve_slots = asyncio.Semaphore(self.max_solves)
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path,
+                                                           limit=self.max_line)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port,
+                                                      limit=self.max_line)
+        return self._server
+
+    @property
+    def address(self):
+        return self._server.sockets[0].getsockname()
+
+    async def close(self):
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        # running solves are not waited for, the event loop keeps running
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    # connections
+
+    async def _handle(self, reader, writer):
+        if len(self._writers) >= self.max_clients:
+            await self._refuse(reader, writer)
+            return
+
+        self._writers.add(writer)
+        pending = asyncio.Semaphore(self.max_pending)
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                # stop reading while too many requests are in flight
+                await pending.acquire()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self._reply(writer, lock, dict(id=None, error="line too long"))
+                    break
+                if not line:
+                    pending.release()
+                    break
+                task = asyncio.ensure_future(self._process(line, writer, lock, pending))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _refuse(self, reader, writer):
+        # answer every request of a connection above max_clients with an error
+        try:
+            async for line in reader:
+                try:
+                    request_id = json.loads(line).get('id')
+                except Exception:
+                    request_id = None
+                await self._send(writer, dict(id=request_id, error="server busy"))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _process(self, line, writer, lock, pending):
+        try:
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+                response = dict(id=request_id, result=await self.dispatch(request))
+            except Exception as e:
+                response = dict(id=request_id, error="%s: %s" % (type(e).__name__, e))
+            await self._reply(writer, lock, response)
+        except ConnectionError:
+            # closed by the client or by close() while the request was running
+            pass
+        finally:
+            pending.release()
+
+    async def _reply(self, writer, lock, response):
+        async with lock:
+            await self._send(writer, response)
+
+    @staticmethod
+    async def _send(writer, response):
+        writer.write(json.dumps(response).encode() + b'\n')
+        await writer.drain()
+
+    # operations
+
+    async def dispatch(self, request):
+        op = request.get('op')
+        name = request.get('cube', 'default')
+        if op == 'new':
+            return await self._new(name, int(request.get('n', 3)))
+        if op == 'scramble':
+            return self._scramble(self._cube(name), int(request.get('moves', 25)),
+                                  request.get('seed'))
+        if op == 'apply':
+            return self._apply(self._cube(name), _moves(request.get('moves', [])))
+        if op == 'state':
+            return self._state(self._cube(name))
+        if op == 'solve':
+            return await self._solve(self._cube(name))
+        raise ValueError("unknown op %r" % op)
+
+    def _cube(self, name):
+        if name not in self.cubes:
+            self._create(name, 3)
+        return self.cubes[name]
+
+    async def _new(self, name, n):
+        if not 1 <= n <= self.max_n:
+            raise ValueError("n must be between 1 and %d" % self.max_n)
+        # the solved geometry of a new size is built (and cached) off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, face_colors, n)
+        self._create(name, n)
+        return self._state(self.cubes[name])
+
+    def _create(self, name, n):
+        self.cubes[name] = dict(n=n, perm=np.arange(6 * n ** 2), history=[])
+
+    def _scramble(self, cube, count, seed=None):
+        # random quarter turns of the outer layers, as Cube._random
+        if not 0 <= count <= self.max_moves:
+            raise ValueError("scramble length must be between 0 and %d" % self.max_moves)
+        rng = Random(seed)
+        moves = [(rng.choice('UDRLFB'), rng.choice([1, -1]), 0) for i in range(count)]
+        self._apply(cube, moves)
+        return dict(moves=format_moves(moves).strip())
+
+    def _apply(self, cube, moves):
+        # the history keeps turns as 1, -1 or 2 (the notation of format_moves)
+        n = cube['n']
+        if len(moves) > self.max_moves:
+            raise ValueError("more than %d moves" % self.max_moves)
+        checked = normalize_moves(moves, n)
+        if len(checked) != len(moves):
+            raise ValueError("moves with zero turns")
+        moves = checked
+        cube['perm'] = cube['perm'][compile_moves(moves, n)]
+        cube['history'] += moves
+        return dict(moves=len(moves))
+
+    def _state(self, cube):
+        n = cube['n']
+        colors = solved_state(n)[cube['perm']]
+        names = face_colors(n)
+        return dict(n=n, facelets="".join(names[c] for c in colors),
+                    solved=bool(is_solved(colors)))
+
+    async def _solve(self, cube):
+        if cube['n'] != 3 or any(layer != 0 for (f, turns, layer) in cube['history']):
+            raise ValueError("only 3x3x3 cubes turned by their outer layers can be solved")
+
+        # identical states share one solve
+        key = cube['perm'].astype(np.uint8).tobytes()
+        future = self._solves.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run_solve(list(cube['history'])))
+            self._solves[key] = future
+            future.add_done_callback(lambda f: self._solves.pop(key, None))
+        solution = await asyncio.shield(future)
+        return dict(moves=format_moves(solution).strip())
+
+    async def _run_solve(self, history):
+        async with self._solve_slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, solve_moves, history)
+
+
+def _moves(moves):
+    # "R U' F2" or [[face, turns, layer], ...]
+    if isinstance(moves, str):
+        return parse_moves(moves)
+    return [(f, turns, layer) for (f, turns, layer) in moves]
+
+
+class CubeClient:
+    # asyncio client for CubeServer, requests can be pipelined
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._waiting = {}
+        self._receiver = asyncio.ensure_future(self._receive())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=None, path=None, limit=1 << 24):
+        # limit: longest response line, a state has 6 * n**2 facelets
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path, limit=limit)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=limit)
+        return cls(reader, writer)
+
+    async def _receive(self):
+        error = ConnectionError("connection closed")
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                if response.get('id') is None:
+                    # error of the whole connection (e.g. server busy)
+                    error = ConnectionError(response.get('error'))
+                    continue
+                future = self._waiting.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except ConnectionError as e:
+            error = e
+        except ValueError as e:
+            # response line above the limit or not JSON, the stream cannot be read further
+            error = ConnectionError("invalid response: %s" % e)
+            self._writer.close()
+        finally:
+            for future in self._waiting.values():
+                if not future.done():
+                    future.set_exception(error)
+            self._waiting.clear()
+
+    async def request(self, op, **params):
+        self._next_id += 1
+        request_id = self._next_id
+        if self._receiver.done():
+            raise ConnectionError("connection closed")
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        params.update(id=request_id, op=op)
+        self._writer.write(json.dumps(params).encode() + b'\n')
+        await self._writer.drain()
+
+        response = await future
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response['result']
+
+    async def new(self, cube='default', n=3):
+        return await self.request('new', cube=cube, n=n)
+
+    async def scramble(self, cube='default', moves=25, seed=None):
+        return await self.request('scramble', cube=cube, moves=moves, seed=seed)
+
+    async def apply(self, moves, cube='default'):
+        return await self.request('apply', cube=cube, moves=moves)
+
+    async def state(self, cube='default'):
+        return await self.request('state', cube=cube)
+
+    async def solve(self, cube='default'):
+        return await self.request('solve', cube=cube)
+
+    async def close(self):
+        self._writer.close()
+        await self._receiver
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def main(port=8765, path=None):
+    server = CubeServer()
+    await server.start(port=port, path=path)
+    print("serving on %s" % (server.address,))
+    await server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        port = int(sys.argv[1])
+        path = None
+    except (IndexError, ValueError):
+        port = 8765
+        path = sys.argv[1] if len(sys.argv) > 1 else None
+
+    asyncio.run(main(port, path))
@@ -0,0 +1,163 @@
+import os
+from time import sleep, monotonic
+from contextlib import nullcontext
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# batches of integer cube states (facelets.py) in shared memory
+#
+# the block starts with a header of 8 int64 values
+#   [magic, n, count, dtype, head, tail, closed, 0]
+# followed by a (count, 6 * n**2) array of states
+# head/tail are used by the ring buffer: states put in total / states taken in total
+#
+# the optional lock is not sent with a pickled batch (only the name is): processes
+# inherit it as an argument of Process/Pool initializer, or use a Manager().Lock(),
+# and pass it to attach()
+
+MAGIC = 0x43554245  # "CUBE"
+HEADER = 8
+DTYPES = [np.dtype(np.uint8), np.dtype(np.uint16), np.dtype(np.int32), np.dtype(np.int64)]
+(_MAGIC, _N, _COUNT, _DTYPE, _HEAD, _TAIL, _CLOSED) = range(7)
+
+
+class CubeBatch:
+    def __init__(self, shm, owner=False, lock=None):
+        self._shm = shm
+        # only the creating process unlinks the block, not its forked children
+        self._owner = os.getpid() if owner else None
+        self.lock = lock  # optional multiprocessing.Lock for several producers/consumers
+
+        self._header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        if self._header[_MAGIC] != MAGIC:
+            raise ValueError("%s is not a cube batch" % shm.name)
+        self.n = int(self._header[_N])
+        self.count = int(self._header[_COUNT])
+        self.dtype = DTYPES[self._header[_DTYPE]]
+        self.states = np.ndarray((self.count, 6 * self.n ** 2), dtype=self.dtype,
+                                 buffer=shm.buf, offset=self._header.nbytes)
+
+    @classmethod
+    def create(cls, n, count, dtype=np.uint8, name=None, lock=None):
+        dtype = np.dtype(dtype)
+        if dtype not in DTYPES:
+            raise ValueError("unsupported dtype %s for a cube batch (use one of %s)"
+                             % (dtype, ", ".join(map(str, DTYPES))))
+        size = HEADER * 8 + count * 6 * n ** 2 * dtype.itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[[_MAGIC, _N, _COUNT, _DTYPE]] = [MAGIC, n, count, DTYPES.index(dtype)]
+        del header
+        return cls(shm, owner=True, lock=lock)
+
+    @classmethod
+    def from_states(cls, states, name=None, lock=None):
+        states = np.asarray(states)
+        n = int(round(np.sqrt(states.shape[-1] / 6)))
+        batch = cls.create(n, len(states), states.dtype, name, lock)
+        batch.states[:] = states
+        return batch
+
+    @classmethod
+    def attach(cls, name, lock=None):
+        # map an existing batch without copying
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # python < 3.13: keep the block out of the resource tracker,
+            # which would unlink it when this process exits
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        return cls(shm, lock=lock)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def __reduce__(self):
+        # processes receive only the name and attach to the same memory
+        return (CubeBatch.attach, (self.name,))
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, item):
+        return self.states[item]
+
+    def __setitem__(self, item, value):
+        self.states[item] = value
+
+    def close(self):
+        # drop the views before closing the mapping
+        self.states = None
+        self._header = None
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ring buffer: producers put chunks of states, consumers get them in order
+
+    def put(self, states, timeout=None):
+        states = np.asarray(states, dtype=self.dtype).reshape(-1, self.states.shape[1])
+        if len(states) > self.count:
+            raise ValueError("chunk larger than the ring")
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            with _locked(self.lock):
+                head, tail = self._header[_HEAD], self._header[_TAIL]
+                if head - tail + len(states) <= self.count:
+                    self._copy(head, states)
+                    # publish the states after they are written
+                    self._header[_HEAD] = head + len(states)
+                    return
+            _wait(deadline)
+
+    def get(self, max_count=None, timeout=None):
+        # copy of the next states (at most max_count), an empty array once closed and drained
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            with _locked(self.lock):
+                head, tail = self._header[_HEAD], self._header[_TAIL]
+                k = int(head - tail)
+                if max_count is not None:
+                    k = min(k, max_count)
+                if k > 0:
+                    ind = (tail + np.arange(k)) % self.count
+                    states = self.states[ind]
+                    self._header[_TAIL] = tail + k
+                    return states
+                if self._header[_CLOSED]:
+                    return self.states[:0].copy()
+            _wait(deadline)
+
+    def close_ring(self):
+        # no more states will be put
+        self._header[_CLOSED] = 1
+
+    def _copy(self, head, states):
+        start = head % self.count
+        first = min(len(states), self.count - start)
+        self.states[start:start + first] = states[:first]
+        self.states[:len(states) - first] = states[first:]
+
+
+def _locked(lock):
+    return nullcontext() if lock is None else lock
+
+
+def _wait(deadline):
+    if deadline is not None and monotonic() > deadline:
+        raise TimeoutError("cube batch ring timed out")
+    sleep(0.0005)
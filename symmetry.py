@@ -0,0 +1,147 @@
+from functools import lru_cache
+from itertools import permutations
+
+import numpy as np
+
+from cube import Cube
+from facelets import point_permutation, face_colors
+
+
+def symmetry_matrices():
+    # the 48 symmetries of the cube: every orthogonal map sending the
+    # face axes of Cube.faces_dict onto each other (24 rotations + 24 reflections)
+    axes = list(Cube.faces_dict.values())
+    mats = []
+    for a, b, c in permutations(axes, 3):
+        M = np.array([a, b, c]).T
+        if np.allclose(np.dot(M.T, M), np.eye(3)):
+            mats.append(M)
+    # put the identity first
+    mats.sort(key=lambda M: (not np.allclose(M, np.eye(3)), np.linalg.det(M) < 0))
+    return np.array(mats)
+
+
+def face_moves(layers=(0,), turns=(1, -1, 2)):
+    # (face, turns, layer) moves used for search tables
+    return [(f, t, layer) for f in 'UDLRFB' for t in turns for layer in layers]
+
+
+class Symmetry:
+    # symmetry conjugation tables for states and moves of an n x n x n cube
+    def __init__(self, n=3, moves=None):
+        self.n = n
+        self.matrices = symmetry_matrices()
+        self.moves = face_moves() if moves is None else list(moves)
+
+        names = face_colors(n)
+        normals = np.array([Cube.faces_dict[f] for f in names])
+
+        # slot permutation and color relabeling for every symmetry
+        self.slot_perms = np.array([point_permutation(n, M) for M in self.matrices])
+        self.color_maps = np.array([self._face_map(normals, M) for M in self.matrices])
+
+        # inverse of each symmetry
+        self.inverse = np.array([self._find(M.T) for M in self.matrices])
+
+        # conjugated moves: s * m * s^-1 for every symmetry s and move m
+        index = {m: i for i, m in enumerate(self.moves)}
+        self.move_table = -np.ones((len(self.matrices), len(self.moves)), dtype=int)
+        for s, M in enumerate(self.matrices):
+            det = int(round(np.linalg.det(M)))
+            for i, (f, t, layer) in enumerate(self.moves):
+                g = self._face_name(np.dot(M, Cube.faces_dict[f]))
+                t2 = det * t
+                if t == 2:
+                    t2 = 2
+                self.move_table[s, i] = index.get((g, t2, layer), -1)
+
+    def _find(self, M):
+        for i, S in enumerate(self.matrices):
+            if np.allclose(S, M):
+                return i
+        raise ValueError("not a symmetry of the cube")
+
+    @staticmethod
+    def _face_name(v):
+        for f, w in Cube.faces_dict.items():
+            if np.allclose(v, w):
+                return f
+        raise ValueError("not a face axis")
+
+    @staticmethod
+    def _face_map(normals, M):
+        # color c is moved onto the face whose normal is M * normal(c)
+        moved = np.dot(normals, M.T)
+        return np.array([np.argmax(np.dot(normals, v)) for v in moved])
+
+    def conjugate(self, state, s):
+        # state seen through symmetry s (batch of states on the last axis)
+        state = np.asarray(state)
+        return self.color_maps[s][state[..., self.slot_perms[s]]]
+
+    def conjugates(self, state):
+        # all 48 symmetric images of a single state, shape (48, 6 * n**2)
+        state = np.asarray(state)
+        images = state[self.slot_perms]
+        return np.take_along_axis(self.color_maps, images, axis=1)
+
+    def conjugate_move(self, s, move):
+        return self.moves[self.move_table[s, self.moves.index(move)]]
+
+    def canonical(self, state, return_symmetry=False):
+        # minimum (lexicographic) representative of the symmetry class of state
+        images = self.conjugates(state)
+        s = np.lexsort(images.T[::-1])[0]
+        if return_symmetry:
+            return images[s], s
+        return images[s]
+
+    def canonical_key(self, state):
+        # hashable key of the symmetry class of state
+        return self.canonical(state).astype(np.uint8).tobytes()
+
+
+@lru_cache(maxsize=None)
+def symmetry(n=3):
+    # shared symmetry tables for cubes of size n
+    return Symmetry(n)
+
+
+class SymmetricSet:
+    # set of cube states storing only one representative per symmetry class
+    def __init__(self, n=3, states=()):
+        self.sym = symmetry(n)
+        self._keys = set()
+        for state in states:
+            self.add(state)
+
+    def add(self, state):
+        self._keys.add(self.sym.canonical_key(state))
+
+    def __contains__(self, state):
+        return self.sym.canonical_key(state) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class SymmetricTable:
+    # dict of cube states (e.g. a pruning table) keyed by symmetry class
+    def __init__(self, n=3):
+        self.sym = symmetry(n)
+        self._data = {}
+
+    def __setitem__(self, state, value):
+        self._data[self.sym.canonical_key(state)] = value
+
+    def __getitem__(self, state):
+        return self._data[self.sym.canonical_key(state)]
+
+    def get(self, state, default=None):
+        return self._data.get(self.sym.canonical_key(state), default)
+
+    def __contains__(self, state):
+        return self.sym.canonical_key(state) in self._data
+
+    def __len__(self):
+        return len(self._data)
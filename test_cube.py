@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba_array
+
+from cube import Cube, Interactive_Cube
+
+
+@pytest.mark.parametrize('n', [3, 30, 300])
+def test_lod_textures_show_sticker_colors(n):
+    cube = Cube(n)
+    fig = plt.figure()
+    ax = Interactive_Cube(cube, fig=fig)
+    try:
+        textures = ax._textures(np.ones(len(cube._colors), dtype=bool))
+    finally:
+        plt.close(fig)
+
+    colors = to_rgba_array(cube.face_colors)
+    plastic = to_rgba_array(cube.main_color)[0]
+    for f, image in textures.items():
+        on_face = np.dot(cube._face_centroids[:, :3], cube.faces_dict[f]) > 0.999
+        color = colors[cube._colors[on_face][0]]
+        sticker = np.all(np.isclose(image, color), axis=-1)
+        assert np.all(sticker | np.all(np.isclose(image, plastic), axis=-1))
+        # the plastic grid takes a small part of the face, if any
+        assert sticker.mean() > 0.5
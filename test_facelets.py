@@ -0,0 +1,87 @@
+from random import Random
+
+import numpy as np
+import pytest
+import pycuber as pc
+
+from cube import Cube, format_moves
+from facelets import (compile_moves, move_permutation, invert_moves, cube_state, solved_state,
+                      apply_moves, face_colors, facelet_grid, is_solved, verify_solutions)
+
+
+@pytest.mark.parametrize('n', [2, 3, 4, 5, 10, 30])
+def test_compile_moves_matches_rotate_face(n):
+    rng = Random(n)
+    moves = [(rng.choice('UDLRFB'), rng.choice([1, -1, 2]), rng.randrange(n))
+             for i in range(20)]
+    cube = Cube(n)
+    for move in moves:
+        cube.rotate_face(*move)
+    assert np.array_equal(cube_state(cube), solved_state(n)[compile_moves(moves, n)])
+
+    other = Cube(n)
+    other.apply_moves(moves)
+    assert np.array_equal(cube_state(other), cube_state(cube))
+
+
+def test_zero_turns_is_identity():
+    assert np.array_equal(move_permutation(3, 'R', 0), np.arange(54))
+    assert np.array_equal(move_permutation(3, 'R', 4, 1), np.arange(54))
+
+
+def test_scramble_large_cube():
+    rng = Random(30)
+    moves = [(rng.choice('UDLRFB'), rng.choice([1, -1]), 0) for i in range(20)]
+    cube = Cube(30)
+    cube.apply_moves(moves)
+    assert not cube.is_solved()
+    cube.apply_moves(invert_moves(moves))
+    assert cube.is_solved()
+
+
+def test_apply_moves_records_checked_moves():
+    cube = Cube(3)
+    cube.apply_moves([('R', 3, 0), ('U', 5, 1), ('F', 4, 0), ('L', -2, 2)])
+    assert cube._move_list == [('R', -1, 0), ('U', 1, 1), ('L', 2, 2)]
+
+    for move in [('R', 0.5, 0), ('U', 1.5, 0), ('F', 1, 3), ('F', 1, -1), ('X', 1, 0)]:
+        with pytest.raises(ValueError):
+            cube.apply_moves([move])
+        with pytest.raises(ValueError):
+            compile_moves([move], 3)
+    assert cube._move_list == [('R', -1, 0), ('U', 1, 1), ('L', 2, 2)]
+
+
+def test_facelet_grid_matches_pycuber():
+    # every face seen from outside, as get_face of pycuber
+    names = np.array(face_colors(3))
+    solved = pc.Cube()
+    face_of = {solved.get_face(f)[1][1].colour: f for f in 'UDLRFB'}
+    rng = Random(34)
+    for i in range(20):
+        moves = [(rng.choice('UDLRFB'), rng.choice([1, -1, 2]), 0) for j in range(25)]
+        grid = names[facelet_grid(apply_moves(solved_state(3), moves))]
+        cube = pc.Cube()
+        cube(format_moves(moves))
+        for c, f in enumerate(names):
+            expected = [[face_of[square.colour] for square in row] for row in cube.get_face(f)]
+            assert grid[c].tolist() == expected
+
+
+def test_is_solved_and_verify_solutions_on_batches():
+    rng = Random(7)
+    scrambles = [[(rng.choice('UDLRFB'), rng.choice([1, -1, 2]), rng.randrange(4))
+                  for j in range(10)] for i in range(8)]
+    states = np.array([apply_moves(solved_state(4), moves) for moves in scrambles])
+    assert not is_solved(states).any()
+    assert is_solved(np.tile(solved_state(4), (3, 1))).all()
+
+    # a whole cube rotation is solved too
+    rotation = [('R', 1, layer) for layer in range(4)]
+    assert is_solved(apply_moves(solved_state(4), rotation))
+
+    solutions = [invert_moves(moves) for moves in scrambles]
+    solutions[3] = solutions[3][:-1]
+    solutions[5] = solutions[5] + rotation
+    assert verify_solutions(states, solutions).tolist() == \
+        [True, True, True, False, True, True, True, True]
@@ -0,0 +1,90 @@
+from random import Random
+
+import numpy as np
+import pytest
+
+import pattern_db
+from pattern_db import PatternDatabase, corner_pieces, edge_pieces
+from facelets import compile_moves
+from symmetry import face_moves
+
+
+def breadth_first(pdb):
+    # distances of all patterns by a search over the slots of the tracked pieces
+    start = tuple(pdb.pieces)
+    seen = {start: 0}
+    frontier = [start]
+    depth = 0
+    while frontier:
+        depth += 1
+        new = []
+        for slots in frontier:
+            for dest in pdb._dest:
+                child = tuple(dest[list(slots)])
+                if child not in seen:
+                    seen[child] = depth
+                    new.append(child)
+        frontier = new
+    return seen
+
+
+@pytest.fixture(scope='module', params=['corners', 'edges'])
+def reference(request):
+    pieces = corner_pieces(3)[:3] if request.param == 'corners' else edge_pieces(3, 3)
+    return pieces, breadth_first(PatternDatabase(3, pieces, 'unused.npy'))
+
+
+def test_rank_unrank(reference):
+    pieces, seen = reference
+    pdb = PatternDatabase(3, pieces, 'unused.npy')
+    slots = np.array(list(seen))
+    ranks = pdb.rank(slots)
+    assert len(np.unique(ranks)) == len(seen) == pdb.size
+    assert np.array_equal(pdb.unrank(ranks), slots)
+
+
+@pytest.mark.parametrize('packing', ['nibble', 'mod3'])
+def test_build_matches_breadth_first(reference, packing, tmp_path):
+    pieces, seen = reference
+    path = str(tmp_path / 'pdb.npy')
+    pdb = PatternDatabase(3, pieces, path, packing).build(processes=1, chunk_size=5000)
+    assert pdb.depth == max(seen.values())
+
+    slots = np.array(list(seen))
+    distances = np.array(list(seen.values()))
+    stored = distances % 3 if packing == 'mod3' else distances
+    assert np.array_equal(pdb[pdb.rank(slots)], stored)
+
+    loaded = PatternDatabase.load(path)
+    rng = Random(packing)
+    moves = face_moves()
+    for i in range(50):
+        perm = compile_moves([rng.choice(moves) for j in range(rng.randrange(12))], 3)
+        assert loaded.distance(perm) == seen[tuple(pdb.pattern(perm)[0])]
+
+
+@pytest.mark.parametrize('packing', ['nibble', 'mod3'])
+def test_resume_after_interrupted_level(packing, tmp_path, monkeypatch):
+    pieces = corner_pieces(3)[:4]
+    reference = PatternDatabase(3, pieces, str(tmp_path / 'reference.npy'), packing)
+    reference.build(processes=1, chunk_size=5000)
+
+    expand = pattern_db._expand
+    calls = []
+
+    def interrupted(args):
+        # fail in the middle of depth 3, after some children were stored
+        calls.append(args)
+        if args[-1] == 3 and len([a for a in calls if a[-1] == 3]) > 10:
+            raise KeyboardInterrupt
+        return expand(args)
+
+    path = str(tmp_path / 'pdb.npy')
+    monkeypatch.setattr(pattern_db, '_expand', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        PatternDatabase(3, pieces, path, packing).build(processes=1, chunk_size=5000)
+    monkeypatch.setattr(pattern_db, '_expand', expand)
+
+    pdb = PatternDatabase(3, pieces, path, packing).build(processes=1, chunk_size=5000)
+    assert pdb.depth == reference.depth
+    assert np.array_equal(np.asarray(pdb.table), np.asarray(reference.table))
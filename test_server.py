@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from server import CubeServer, CubeClient
+from cube import parse_moves
+from facelets import compile_moves, solved_state, face_colors
+
+
+def run(test, **options):
+    # test(server, client) against a server on a free local port
+    async def main():
+        server = CubeServer(solve_workers=1, **options)
+        await server.start(port=0)
+        client = await CubeClient.connect(port=server.address[1])
+        try:
+            return await test(server, client)
+        finally:
+            await client.close()
+            await server.close()
+    return asyncio.run(main())
+
+
+def facelets(moves, n=3):
+    names = face_colors(n)
+    return "".join(names[c] for c in solved_state(n)[compile_moves(moves, n)])
+
+
+def test_round_trips():
+    async def test(server, client):
+        state = await client.new('a', 3)
+        assert state['solved'] and state['facelets'] == facelets([])
+
+        scramble = await client.scramble('a', moves=20, seed=5)
+        moves = parse_moves(scramble['moves'])
+        state = await client.state('a')
+        assert not state['solved'] and state['facelets'] == facelets(moves)
+
+        await client.apply([['R', 3, 0], ['U', 2, 0]], cube='a')
+        assert server.cubes['a']['history'][-2:] == [('R', -1, 0), ('U', 2, 0)]
+        await client.apply("U2 R", cube='a')
+        assert (await client.state('a'))['facelets'] == facelets(moves)
+
+        solution = await client.solve('a')
+        await client.apply(solution['moves'], cube='a')
+        assert (await client.state('a'))['solved']
+    run(test)
+
+
+def test_concurrent_solves_share_one_job():
+    async def test(server, client):
+        jobs = []
+        run_solve = server._run_solve
+
+        async def counted(history):
+            jobs.append(history)
+            return await run_solve(history)
+        server._run_solve = counted
+
+        await client.scramble('a', moves=20, seed=1)
+        await client.scramble('b', moves=20, seed=1)
+        first, second = await asyncio.gather(client.solve('a'), client.solve('b'))
+        assert first == second
+        assert len(jobs) == 1
+    run(test)
+
+
+@pytest.mark.parametrize('moves', ["Rw U", "R3", [['R', 0, 0]], [['R', 1.5, 0]],
+                                   [['F', 1, 3]], [['UD', 1, 0]]])
+def test_rejected_moves(moves):
+    async def test(server, client):
+        await client.new('a', 3)
+        with pytest.raises(RuntimeError, match='ValueError'):
+            await client.apply(moves, cube='a')
+        assert (await client.state('a'))['solved']
+        assert server.cubes['a']['history'] == []
+    run(test)
+
+
+def test_limits():
+    async def test(server, client):
+        with pytest.raises(RuntimeError, match='n must be'):
+            await client.new('a', 11)
+        with pytest.raises(RuntimeError, match='scramble length'):
+            await client.scramble('a', moves=101)
+        with pytest.raises(RuntimeError, match='more than'):
+            await client.apply("R " * 101, cube='a')
+        assert 'a' not in server.cubes or server.cubes['a']['history'] == []
+    run(test, max_n=10, max_moves=100)
+
+
+def test_large_responses():
+    async def test(server, client):
+        # longer than the 64 KiB default line limit of asyncio streams
+        state = await client.new('big', 110)
+        assert len(state['facelets']) == 6 * 110 ** 2
+        await client.apply([['U', 1, 54]], cube='big')
+        assert not (await client.state('big'))['solved']
+
+        small = await CubeClient.connect(port=server.address[1], limit=1000)
+        try:
+            with pytest.raises(ConnectionError, match='invalid response'):
+                await small.state('big')
+        finally:
+            await small.close()
+    run(test)